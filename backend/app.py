@@ -6,8 +6,9 @@ import logging
 import json
 import re
 import difflib  
-from datetime import datetime, timedelta
-from fastapi import FastAPI, WebSocket, HTTPException, status, Depends, WebSocketDisconnect
+from datetime import date, datetime, timedelta
+from typing import Optional
+from fastapi import FastAPI, WebSocket, HTTPException, status, Depends, WebSocketDisconnect, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
 
@@ -19,7 +20,6 @@ from auth import get_current_user
 
 
 import asyncio
-from collections import deque
 from dotenv import load_dotenv
 
 import time
@@ -30,17 +30,26 @@ from auth import (
     create_access_token, 
     get_password_hash, 
     get_current_active_user,
+    get_current_admin_user,
     verify_websocket_token,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from models import UserCreate, UserLogin, Token, User, UserInDB, UserUpdate, CalibrationData
-from database import users_collection, close_database_connection
+from models import UserCreate, UserLogin, Token, User, UserInDB, UserUpdate, CalibrationData, ProfileRequest, ProfileResult
+from database import users_repository, close_database_connection
+from logging_config import configure_logging, bind_session_id
+from optotypes import etag_matches, get_ladder, invalidate_ladder
+from rollups import SCOPE_DAILY, SCOPE_USER_DAILY
+from profiling import start_run, run_profiled
+from session import (
+    TestSession, CHANNEL_CONTROL, CHANNEL_FRAMES, CHANNEL_VOICE, active_sessions, open_session, close_session,
+    resume_detection, suspend_detection
+)
 # ---
 
 load_dotenv()
 
-# Set logging to DEBUG to see all messages
-logging.basicConfig(level=logging.INFO)
+# Queue-based structured logging; LOG_LEVEL / LOG_FORMAT / SAMPLED_LOG_RATE tune it
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Face Detection API with Authentication")
@@ -70,46 +79,42 @@ except Exception as e:
     logger.error(f"Failed to load Face Detector: {e}")
 
 KNOWN_FACE_WIDTH = 0.15  
-FOCAL_LENGTH = None  
 TARGET_DISTANCE = 4.0  
 DISTANCE_THRESHOLD = 0.2  
 
-calibration_active = False
-distance_measurement_active = False
-previous_distances = deque(maxlen=5)
-
-
+# Focal length, calibration/distance modes and the smoothing buffer live on
+# each TestSession, so concurrent patients never share them.
 
-def calculate_distance(face_width):
-    return round((KNOWN_FACE_WIDTH * FOCAL_LENGTH) / face_width, 2) if FOCAL_LENGTH and face_width > 0 else -1
+def calculate_distance(face_width, focal_length):
+    return round((KNOWN_FACE_WIDTH * focal_length) / face_width, 2) if focal_length and face_width > 0 else -1
 
-def calculate_expected_face_width_at_distance(distance):
-    return int((KNOWN_FACE_WIDTH * FOCAL_LENGTH) / distance) if FOCAL_LENGTH else 0
+def calculate_expected_face_width_at_distance(distance, focal_length):
+    return int((KNOWN_FACE_WIDTH * focal_length) / distance) if focal_length else 0
 
-def calibrate_focal_length(face_width, known_distance=0.7):
-    global FOCAL_LENGTH
-    FOCAL_LENGTH = (face_width * known_distance) / KNOWN_FACE_WIDTH
-    logger.info(f"Focal length calibrated: {FOCAL_LENGTH}")
-    return FOCAL_LENGTH
+def calibrate_focal_length(session: TestSession, face_width, known_distance=0.7):
+    session.focal_length = (face_width * known_distance) / KNOWN_FACE_WIDTH
+    logger.info("Focal length calibrated: %s", session.focal_length)
+    return session.focal_length
 
-def smooth_distance(new_distance):
+def smooth_distance(session: TestSession, new_distance):
     if new_distance <= 0: return new_distance
-    previous_distances.append(new_distance)
-    if len(previous_distances) >= 3:
-        sorted_distances = sorted(previous_distances)
+    session.previous_distances.append(new_distance)
+    if len(session.previous_distances) >= 3:
+        sorted_distances = sorted(session.previous_distances)
         return sorted_distances[len(sorted_distances) // 2]
     return new_distance
 
 def is_at_target_distance(distance):
     return abs(distance - TARGET_DISTANCE) <= DISTANCE_THRESHOLD
 
-def create_processed_image(frame, faces, distance=-1, quality=70):
+def create_processed_image(session: TestSession, frame, faces, distance=-1, quality=70):
     output_frame = frame.copy()
     height, width = output_frame.shape[:2]
     center_x, center_y = width // 2, height // 2
+    measuring = session.distance_measurement_active and session.focal_length
     
-    if distance_measurement_active and FOCAL_LENGTH:
-        expected_face_width = calculate_expected_face_width_at_distance(TARGET_DISTANCE)
+    if measuring:
+        expected_face_width = calculate_expected_face_width_at_distance(TARGET_DISTANCE, session.focal_length)
         if expected_face_width > 0:
             expected_face_height = int(expected_face_width * 1.5)
             ref_x = center_x - expected_face_width // 2
@@ -129,8 +134,8 @@ def create_processed_image(frame, faces, distance=-1, quality=70):
             cv2.rectangle(output_frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
             text = f"{confidence:.2f}"
             cv2.putText(output_frame, text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-            if distance_measurement_active and FOCAL_LENGTH:
-                distance = calculate_distance(w)
+            if measuring:
+                distance = calculate_distance(w, session.focal_length)
                 if distance > 0:
                     color = (0, 255, 0) if is_at_target_distance(distance) else (255, 0, 0)
                     thickness = 2 if is_at_target_distance(distance) else 1
@@ -144,8 +149,7 @@ def create_processed_image(frame, faces, distance=-1, quality=70):
     img_str = base64.b64encode(buffer).decode('utf-8')
     return f"data:image/jpeg;base64,{img_str}"
 
-async def process_image(image_data):
-    global calibration_active, distance_measurement_active
+async def process_image(session: TestSession, image_data):
     if face_detector is None:
         return {"error": "Face detector not initialized"}
 
@@ -166,16 +170,16 @@ async def process_image(image_data):
         faces = results[1] if results is not None and len(results) > 1 else None
 
         reference_box = None
-        if FOCAL_LENGTH:
-            expected_width = calculate_expected_face_width_at_distance(TARGET_DISTANCE)
+        if session.focal_length:
+            expected_width = calculate_expected_face_width_at_distance(TARGET_DISTANCE, session.focal_length)
             if expected_width > 0:
                 reference_box = {"width": expected_width, "height": int(expected_width * 1.5)}
 
         if faces is None or len(faces) == 0:
             return {
                 "success": False, "message": "No face detected",
-                "reference_box": reference_box if distance_measurement_active else None,
-                "processed_image": create_processed_image(frame, None, quality=60),
+                "reference_box": reference_box if session.distance_measurement_active else None,
+                "processed_image": create_processed_image(session, frame, None, quality=60),
                 "face_detected": False
             }
 
@@ -183,37 +187,37 @@ async def process_image(image_data):
         x, y, fw, fh, confidence = map(float, face[:5])
 
         if confidence >= 0.4:
-            if calibration_active:
-                focal = calibrate_focal_length(fw)
-                calibration_active = False
+            if session.calibration_active:
+                focal = calibrate_focal_length(session, fw)
+                session.calibration_active = False
                 return {
                     "success": True, "message": "Calibration complete", "focal_length": focal,
-                    "processed_image": create_processed_image(frame, faces, quality=60), "face_detected": True
+                    "processed_image": create_processed_image(session, frame, faces, quality=60), "face_detected": True
                 }
 
-            if distance_measurement_active and FOCAL_LENGTH:
-                raw_distance = calculate_distance(fw)
-                smoothed_distance = smooth_distance(raw_distance)
+            if session.distance_measurement_active and session.focal_length:
+                raw_distance = calculate_distance(fw, session.focal_length)
+                smoothed_distance = smooth_distance(session, raw_distance)
                 at_target = is_at_target_distance(smoothed_distance)
                 return {
                     "success": True,
                     "faces": [{"x": int(x), "y": int(y), "width": int(fw), "height": int(fh), "confidence": round(confidence, 2), "distance": smoothed_distance}],
-                    "focal_length": FOCAL_LENGTH, "reference_box": reference_box,
-                    "processed_image": create_processed_image(frame, faces, smoothed_distance, quality=60),
+                    "focal_length": session.focal_length, "reference_box": reference_box,
+                    "processed_image": create_processed_image(session, frame, faces, smoothed_distance, quality=60),
                     "face_detected": True, "at_target_distance": at_target
                 }
             
             return {
                 "success": True, "message": "Face detected, but distance mode is off.",
-                "processed_image": create_processed_image(frame, faces, quality=60), "face_detected": True
+                "processed_image": create_processed_image(session, frame, faces, quality=60), "face_detected": True
             }
 
         return {
             "success": False, "message": "Face detected but confidence too low",
-            "processed_image": create_processed_image(frame, None, quality=60), "face_detected": False
+            "processed_image": create_processed_image(session, frame, None, quality=60), "face_detected": False
         }
     except Exception as e:
-        logger.error(f"Error in processing: {e}")
+        logger.error("Error in processing: %s", e, extra={"sample": "frame.error"})
         return {"error": str(e)}
 
 # --- Auth Endpoints (Preserved) ---
@@ -226,35 +230,22 @@ async def save_test_result(
     report: TestReport, 
     current_user: User = Depends(get_current_user)
 ):
-    print(f"DEBUG: Endpoint hit by user: {current_user.email}")
-    print(f"DEBUG: User ID type: {type(current_user.id)} Value: {current_user.id}")
-    
-  
     report_data = report.dict()
-    print(f"DEBUG: Payload received: {report_data}")
-    
-    update_result = await users_collection.update_one(
-        {"_id": current_user.id},
-        {"$push": {"test_history": report_data}}
-    )
+    updated_user = await users_repository.append_report(current_user.id, report_data)
 
-    print(f"DEBUG: Matched: {update_result.matched_count}, Modified: {update_result.modified_count}")
-
-    if update_result.matched_count == 0:
-        print("DEBUG: ERROR - No user found with that ID to update.")
+    if updated_user is None:
+        logger.warning("No user found to save test result", extra={"user_id": str(current_user.id)})
         raise HTTPException(status_code=400, detail="User not found for update")
 
-    if update_result.modified_count == 0:
-        print("DEBUG: WARNING - User found, but document was not modified (maybe data was same?)")
-        
+    logger.info("Test result saved", extra={
+        "user_id": str(current_user.id), "test_type": report.test_type, "final_acuity": report.final_acuity
+    })
 
-    # Fetch updated user
-    updated_user = await users_collection.find_one({"_id": current_user.id})
     return updated_user
 
 @app.post("/auth/register", response_model=Token)
 async def register(user: UserCreate):
-    existing_user = await users_collection.find_one({"email": user.email})
+    existing_user = await users_repository.find_by_email(user.email)
     if existing_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
     
@@ -267,7 +258,7 @@ async def register(user: UserCreate):
     user_dict['updated_at'] = datetime.utcnow()
     
     user_in_db = UserInDB(**user_dict)
-    await users_collection.insert_one(user_in_db.dict(by_alias=True, exclude={"id"}))
+    await users_repository.create_user(user_in_db.dict(by_alias=True, exclude={"id"}))
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": user.email}, expires_delta=access_token_expires)
@@ -290,8 +281,8 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 async def update_calibration(calibration_data: CalibrationData, current_user: User = Depends(get_current_active_user)):
     update_data = calibration_data.dict(exclude_unset=True)
     update_data['updated_at'] = datetime.utcnow()
-    await users_collection.update_one({"email": current_user.email}, {"$set": update_data})
-    updated_user = await users_collection.find_one({"email": current_user.email})
+    updated_user = await users_repository.update_calibration(current_user.email, update_data)
+    invalidate_ladder(str(current_user.id))
     return User(**updated_user)
 
 @app.get("/auth/calibration", response_model=CalibrationData)
@@ -309,8 +300,10 @@ async def protected_route(current_user: User = Depends(get_current_active_user))
 # --- Calibration WebSocket (Preserved) ---
 @app.websocket("/ws/calibration")
 async def calibration_websocket(websocket: WebSocket):
-    global calibration_active, distance_measurement_active
     await websocket.accept()
+    # Used during signup, before the patient has an account
+    session = open_session(None)
+    bind_session_id(session.id)
     rate_limit = 0.05  
     last_process_time = 0
     try:
@@ -320,11 +313,11 @@ async def calibration_websocket(websocket: WebSocket):
             if "command" in data:
                 cmd = data["command"]
                 if cmd == "start_calibration":
-                    calibration_active = True
-                    distance_measurement_active = False
+                    session.calibration_active = True
+                    session.distance_measurement_active = False
                     await websocket.send_json({"message": "Please stand at one-arm distance and click Capture"})
                 elif cmd == "capture" and "image" in data:
-                    response = await process_image(data["image"])
+                    response = await run_profiled(session.id, process_image, session, data["image"])
                     await websocket.send_json(response)
                 continue
             if "image" in data:
@@ -332,18 +325,44 @@ async def calibration_websocket(websocket: WebSocket):
                 if current_time - last_process_time < rate_limit:
                     continue
                 last_process_time = current_time
-                response = await process_image(data["image"])
+                response = await run_profiled(session.id, process_image, session, data["image"])
                 await websocket.send_json(response)
     except WebSocketDisconnect:
         logger.info("Calibration WebSocket disconnected")
     except Exception as e:
         logger.error(f"Calibration WebSocket error: {e}")
+    finally:
+        close_session(session)
 
 # --- Face Detection WebSocket (Preserved) ---
+async def handle_detection_command(session: TestSession, data):
+    """Apply a detection command from /ws or the frames channel and return the reply."""
+    cmd = data["command"]
+    if cmd == "start_calibration":
+        session.calibration_active = True
+        session.distance_measurement_active = False
+        return {"message": "Please stand at one-arm distance and click Capture"}
+    elif cmd == "start_distance":
+        if "focal_length" not in data:
+            return {"error": "No focal length provided. Please calibrate first."}
+        session.focal_length = data["focal_length"]
+        session.previous_distances.clear()
+        logger.info("Using user's focal length: %s", session.focal_length)
+        session.distance_measurement_active = True
+        session.calibration_active = False
+        return {"message": f"Distance measurement started with focal length: {session.focal_length}"}
+    elif cmd == "stop_all":
+        session.calibration_active = False
+        session.distance_measurement_active = False
+        return {"message": "Measurement stopped"}
+    elif cmd == "capture" and "image" in data:
+        return await process_image(session, data["image"])
+    return None
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    global calibration_active, distance_measurement_active, FOCAL_LENGTH
     await websocket.accept()
+    bind_session_id()
     try:
         auth_data = await websocket.receive_json()
         if "token" not in auth_data:
@@ -361,62 +380,58 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.close(code=1008)
         return
     
+    session = open_session(user)
+    resume_detection(session)
+    bind_session_id(session.id)
     rate_limit = 0.05  
     last_process_time = 0
     
-    while True:
-        try:
-            data = await websocket.receive_json()
-            if "command" in data:
-                cmd = data["command"]
-                if cmd == "start_calibration":
-                    calibration_active = True
-                    distance_measurement_active = False
-                    await websocket.send_json({"message": "Please stand at one-arm distance and click Capture"})
-                elif cmd == "start_distance":
-                    if "focal_length" in data:
-                        FOCAL_LENGTH = data["focal_length"]
-                        logger.info(f"Using user's focal length: {FOCAL_LENGTH}")
-                        await websocket.send_json({"message": f"Distance measurement started with focal length: {FOCAL_LENGTH}"})
-                    else:
-                        await websocket.send_json({"error": "No focal length provided. Please calibrate first."})
+    try:
+        while True:
+            try:
+                data = await websocket.receive_json()
+                if "command" in data:
+                    response = await handle_detection_command(session, data)
+                    if response is not None:
+                        await websocket.send_json(response)
+                    continue
+                if "image" in data:
+                    current_time = asyncio.get_event_loop().time()
+                    if current_time - last_process_time < rate_limit:
                         continue
-                    distance_measurement_active = True
-                    calibration_active = False
-                elif cmd == "stop_all":
-                    calibration_active = False
-                    distance_measurement_active = False
-                    await websocket.send_json({"message": "Measurement stopped"})
-                elif cmd == "capture" and "image" in data:
-                    response = await process_image(data["image"])
+                    last_process_time = current_time
+                    response = await run_profiled(session.id, process_image, session, data["image"])
                     await websocket.send_json(response)
-                continue
-            if "image" in data:
-                current_time = asyncio.get_event_loop().time()
-                if current_time - last_process_time < rate_limit:
-                    continue
-                last_process_time = current_time
-                response = await process_image(data["image"])
-                await websocket.send_json(response)
-        except WebSocketDisconnect:
-            logger.info("WebSocket disconnected")
-            break
-        except Exception as e:
-            logger.error(f"WebSocket error: {e}")
-            break
+            except WebSocketDisconnect:
+                logger.info("WebSocket disconnected")
+                break
+            except Exception as e:
+                logger.error("WebSocket error: %s", e)
+                break
+    finally:
+        suspend_detection(session)
+        close_session(session)
 
 # --- Landolt C Screen PPI Endpoint (Preserved) ---
 @app.get("/api/get-screen-ppi")
 async def get_screen_ppi(current_user: User = Depends(get_current_active_user)):
-    try:
-        user_data = await users_collection.find_one({"email": current_user.email})
-        if user_data and user_data.get('screen_ppi'):
-            return {"screen_ppi": user_data['screen_ppi']}
-        else:
-            return {"screen_ppi": 96.0}
-    except Exception as e:
-        logger.error(f"Error fetching screen PPI: {e}")
-        return {"screen_ppi": 96.0}
+    # The auth dependency already loaded the user document
+    if current_user.screen_ppi:
+        return {"screen_ppi": current_user.screen_ppi}
+    return {"screen_ppi": 96.0}
+
+# --- Landolt C Size Ladder ---
+@app.get("/api/optotype-ladder")
+async def get_optotype_ladder(request: Request, current_user: User = Depends(get_current_active_user)):
+    """Optotype and gap sizes (mm and px) for every acuity level at TARGET_DISTANCE.
+
+    Computed once per calibration; clients revalidate with If-None-Match.
+    """
+    etag, body = get_ladder(str(current_user.id), current_user.screen_ppi, current_user.pixels_per_mm, TARGET_DISTANCE)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # --- UPDATED: Text-Based Voice Logic (REPLACED Vosk logic) ---
 def process_voice_command(text: str):
@@ -428,7 +443,7 @@ def process_voice_command(text: str):
     text = text.lower().strip()
     text = re.sub(r'[^\w\s]', '', text) 
     
-    logger.info(f"[VOICE] Processing cleaned text: '{text}'")
+    logger.info("[VOICE] Processing cleaned text: '%s'", text, extra={"sample": "voice.utterance"})
     
     # 2. Exact phrase mapping
     phrase_map = {
@@ -470,19 +485,65 @@ def process_voice_command(text: str):
                 # Use strict threshold (0.85) to avoid false positives
                 similarity = difflib.SequenceMatcher(None, word, pattern).ratio()
                 if similarity > 0.85:
-                    logger.info(f"[VOICE] Fuzzy match: '{word}' -> '{dir_name}'")
+                    logger.info("[VOICE] Fuzzy match: '%s' -> '%s'", word, dir_name, extra={"sample": "voice.fuzzy"})
                     return dir_name
     
     return None
 
 # --- UPDATED: Voice WebSocket (Handles Text Only) ---
+async def handle_voice_message(session: TestSession, data):
+    """Advance the voice state of a session and return the reply, if any."""
+    command = data.get("command")
+    
+    if command == "prepare_voice_model":
+        # Dummy response to keep frontend state machine happy
+        return {"status": "ready_for_test"}
+
+    elif command == "START_SYMBOL" or command == "NEXT_SYMBOL":
+        # Ensure we strip whitespace/case from the game state too
+        raw_orientation = data.get("orientation", "")
+        session.current_symbol = raw_orientation.lower().strip()
+        logger.info("[VOICE] Game Expecting: '%s'", session.current_symbol, extra={"sample": "voice.symbol"})
+    
+    elif command == "STOP_LISTENING":
+        session.current_symbol = None
+    
+    # Input from Web Speech API
+    elif command == "VOICE_INPUT":
+        raw_text = data.get("text", "")
+        processed_cmd = process_voice_command(raw_text)
+        
+        if not processed_cmd:
+            logger.info("[VOICE] Unrecognized: '%s'", raw_text, extra={"sample": "voice.unrecognized"})
+            return {"status": "UNRECOGNIZED", "text": raw_text}
+
+        logger.info(
+            "[VOICE] Matched Command: '%s' vs Expected: '%s'", processed_cmd, session.current_symbol,
+            extra={"sample": "voice.match"}
+        )
+        
+        if processed_cmd == "pause":
+            return {"status": "PAUSE_REQUESTED"}
+
+        if session.current_symbol:
+            is_correct = (processed_cmd == session.current_symbol)
+            
+            # Only clear if correct? No, clear to prevent double processing of same word
+            if is_correct:
+                session.current_symbol = None 
+            
+            return {
+                "status": "CORRECT" if is_correct else "INCORRECT",
+                "text": raw_text
+            }
+    return None
+
 @app.websocket("/ws_voice")
 async def websocket_voice(websocket: WebSocket):
     await websocket.accept()
     logger.info("[VOICE] WebSocket accepted")
     
-    current_symbol = None 
-    
+    session = None
     try:
         token = websocket.query_params.get("token")
         if not token:
@@ -494,7 +555,9 @@ async def websocket_voice(websocket: WebSocket):
             await websocket.close(1008, "Invalid token")
             return
         
-        await websocket.send_json({"status": "authenticated", "user": user.full_name})
+        session = open_session(user)
+        bind_session_id(session.id)
+        await websocket.send_json({"status": "authenticated", "user": user.full_name, "session_id": session.id})
 
         while True:
             try:
@@ -507,60 +570,182 @@ async def websocket_voice(websocket: WebSocket):
                 logger.info("[VOICE] Client disconnected gracefully")
                 break
             
-            command = data.get("command")
-            
-            if command == "prepare_voice_model":
-                 # Dummy response to keep frontend state machine happy
-                 await websocket.send_json({"status": "ready_for_test"})
-
-            elif command == "START_SYMBOL" or command == "NEXT_SYMBOL":
-                # Ensure we strip whitespace/case from the game state too
-                raw_orientation = data.get("orientation", "")
-                current_symbol = raw_orientation.lower().strip()
-                logger.info(f"[VOICE] Game Expecting: '{current_symbol}'")
-            
-            elif command == "STOP_LISTENING":
-                current_symbol = None
-            
-            # Input from Web Speech API
-            elif command == "VOICE_INPUT":
-                raw_text = data.get("text", "")
-                processed_cmd = process_voice_command(raw_text)
-                
-                if processed_cmd:
-                    logger.info(f"[VOICE] Matched Command: '{processed_cmd}' vs Expected: '{current_symbol}'")
-                    
-                    if processed_cmd == "pause":
-                        await websocket.send_json({"status": "PAUSE_REQUESTED"})
-                        continue
-
-                    if current_symbol:
-                        is_correct = (processed_cmd == current_symbol)
-                        
-                        await websocket.send_json({
-                            "status": "CORRECT" if is_correct else "INCORRECT",
-                            "text": raw_text
-                        })
-                        
-                        # Only clear if correct? No, clear to prevent double processing of same word
-                        if is_correct:
-                            current_symbol = None 
-                else:
-                    logger.info(f"[VOICE] Unrecognized: '{raw_text}'")
-                    await websocket.send_json({"status": "UNRECOGNIZED", "text": raw_text})
+            response = await run_profiled(session.id, handle_voice_message, session, data)
+            if response is not None:
+                await websocket.send_json(response)
 
     except WebSocketDisconnect:
         logger.info("[VOICE] Disconnected")
     except Exception as e:
         logger.error(f"[VOICE] Unexpected error: {e}", exc_info=True)
+    finally:
+        if session is not None:
+            close_session(session)
+
+# --- Multiplexed Session WebSocket ---
+@app.websocket("/ws_session")
+async def websocket_session(websocket: WebSocket):
+    """Frames, voice and control channels over one authenticated connection.
+
+    Every message carries a "channel" key ("frames", "voice" or "control");
+    the rest of the payload is what /ws or /ws_voice would have received.
+    """
+    await websocket.accept()
+    try:
+        token = websocket.query_params.get("token")
+        if not token:
+            auth_data = await websocket.receive_json()
+            token = auth_data.get("token")
+        user = await verify_websocket_token(token) if token else None
+        if not user:
+            await websocket.send_json({"channel": CHANNEL_CONTROL, "error": "Invalid authentication token"})
+            await websocket.close(code=1008)
+            return
+    except Exception as e:
+        logger.error("[SESSION] Authentication error: %s", e)
+        await websocket.close(code=1008)
+        return
+
+    session = open_session(user)
+    bind_session_id(session.id)
+    logger.info("[SESSION] %s opened for user %s (%d active)", session.id, user.id, len(active_sessions))
+    await websocket.send_json({
+        "channel": CHANNEL_CONTROL, "status": "authenticated",
+        "user": user.full_name, "session_id": session.id
+    })
+
+    rate_limit = 0.05
+    try:
+        while True:
+            try:
+                data = await websocket.receive_json()
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(data, dict):
+                await websocket.send_json({"channel": CHANNEL_CONTROL, "error": "Messages must be JSON objects"})
+                continue
+
+            channel = data.get("channel")
+            response = None
+
+            if channel == CHANNEL_FRAMES:
+                if "command" in data:
+                    response = await handle_detection_command(session, data)
+                elif "image" in data:
+                    if session.detection_paused:
+                        session.frames_skipped += 1
+                        continue
+                    current_time = asyncio.get_event_loop().time()
+                    if current_time - session.last_process_time < rate_limit:
+                        session.frames_skipped += 1
+                        continue
+                    session.last_process_time = current_time
+                    session.frames_processed += 1
+                    response = await run_profiled(session.id, process_image, session, data["image"])
+
+            elif channel == CHANNEL_VOICE:
+                was_paused = session.detection_paused
+                response = await run_profiled(session.id, handle_voice_message, session, data)
+                if session.detection_paused != was_paused:
+                    await websocket.send_json({"channel": CHANNEL_CONTROL, "detection_paused": session.detection_paused})
+
+            elif channel == CHANNEL_CONTROL:
+                command = data.get("command")
+                if command == "pause_detection_on_answer":
+                    session.pause_detection_on_answer = bool(data.get("enabled", True))
+                    response = {"pause_detection_on_answer": session.pause_detection_on_answer}
+                elif command == "ping":
+                    response = {"status": "pong"}
+                else:
+                    response = {"error": f"Unknown control command: {command}"}
+
+            else:
+                response = {"error": f"Unknown channel: {channel}"}
+
+            if response is not None:
+                await websocket.send_json({"channel": channel, **response})
 
+    except WebSocketDisconnect:
+        logger.info("[SESSION] %s disconnected", session.id)
+    except Exception as e:
+        logger.error("[SESSION] %s error: %s", session.id, e, exc_info=True)
+    finally:
+        close_session(session)
+
+# --- Admin: On-demand Profiling ---
+@app.get("/admin/sessions")
+async def list_sessions(current_user: User = Depends(get_current_admin_user)):
+    """Open WebSocket sessions, whose ids can be passed to /admin/profile."""
+    return [
+        {
+            "session_id": session.id,
+            "user": session.user.email if session.user else None,
+            "frames_processed": session.frames_processed,
+            "frames_skipped": session.frames_skipped,
+        }
+        for session in active_sessions.values()
+    ]
+
+@app.post("/admin/profile", response_model=ProfileResult)
+async def profile_sessions(request: ProfileRequest, current_user: User = Depends(get_current_admin_user)):
+    """Profile the next N frames/utterances or N seconds, for one session or the whole process.
+
+    Returns flamegraph-compatible collapsed stacks and a tracemalloc top-allocations report.
+    """
+    if not request.frames and not request.seconds:
+        raise HTTPException(status_code=400, detail="Specify frames and/or seconds")
+    if request.session_id and request.session_id not in active_sessions:
+        raise HTTPException(status_code=404, detail="Session not found")
+    try:
+        run = start_run(
+            mode=request.mode, frames=request.frames, seconds=request.seconds,
+            session_id=request.session_id, interval=request.interval_ms / 1000
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    logger.info("Profiling started by user %s: %s", current_user.id, request)
+    await run.wait()
+    return ProfileResult(
+        mode=run.mode, session_id=run.session_id, frames=run.frames, duration=round(run.duration, 3),
+        collapsed_stacks=run.collapsed_stacks(), top_allocations=run.top_allocations
+    )
+
+# --- Acuity Statistics (incrementally maintained rollups) ---
+@app.get("/api/stats/acuity")
+async def get_my_acuity_stats(
+    test_type: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Per-day acuity trend of the current user."""
+    return await users_repository.get_rollups(
+        SCOPE_USER_DAILY, test_type=test_type, user_id=str(current_user.id),
+        start=start.isoformat() if start else None, end=end.isoformat() if end else None
+    )
+
+@app.get("/admin/stats/acuity")
+async def get_acuity_stats(
+    test_type: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: Optional[str] = None,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Clinic-wide acuity distribution per day and test type, or one user's trend with user_id."""
+    return await users_repository.get_rollups(
+        SCOPE_USER_DAILY if user_id else SCOPE_DAILY, test_type=test_type, user_id=user_id,
+        start=start.isoformat() if start else None, end=end.isoformat() if end else None
+    )
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "active_sessions": len(active_sessions)}
 
 @app.on_event("startup")
 async def startup_event():
+    await users_repository.ensure_indexes()
     logger.info("Face Detection API with Authentication started")
     # init_voice_model() - Removed
 
@@ -568,6 +753,7 @@ async def startup_event():
 async def shutdown_event():
     await close_database_connection()
     logger.info("Face Detection API shut down")
+    log_listener.stop()
 
 if __name__ == "__main__":
     import uvicorn
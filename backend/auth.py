@@ -7,7 +7,7 @@ from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from models import TokenData, User, UserInDB, UserCreate
-from database import users_collection
+from database import users_repository
 from bson import ObjectId
 
 load_dotenv()
@@ -16,6 +16,8 @@ load_dotenv()
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "fallback-secret-key-change-this")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Comma-separated emails allowed to use the /admin endpoints
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -40,7 +42,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 async def get_user_by_email(email: str) -> Optional[UserInDB]:
-    user_data = await users_collection.find_one({"email": email})
+    user_data = await users_repository.find_by_email(email)
     if user_data:
         return UserInDB(**user_data)
     return None
@@ -48,7 +50,7 @@ async def get_user_by_email(email: str) -> Optional[UserInDB]:
 async def get_user_by_id(user_id: str) -> Optional[UserInDB]:
     if not ObjectId.is_valid(user_id):
         return None
-    user_data = await users_collection.find_one({"_id": ObjectId(user_id)})
+    user_data = await users_repository.find_by_id(ObjectId(user_id))
     if user_data:
         return UserInDB(**user_data)
     return None
@@ -88,6 +90,11 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)) -> User:
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user
+
 # WebSocket token verification
 async def verify_websocket_token(token: str) -> Optional[User]:
     try:
@@ -0,0 +1,22 @@
+"""Rebuild the acuity rollups from every stored test report.
+
+Reports are read and applied in streaming batches, so memory stays flat
+however many reports exist. The new rollups are built next to the live ones
+and swapped in at the end, so the API keeps serving reads and saving reports
+while this runs. With Mongo, a report saved at the very moment of the swap
+can be counted twice; run this again at a quiet time if that matters.
+
+Usage: python backfill_rollups.py [batch_size]
+"""
+import asyncio
+import sys
+from database import users_repository, close_database_connection
+
+async def main(batch_size: int):
+    await users_repository.ensure_indexes()
+    total = await users_repository.rebuild_rollups(batch_size)
+    print(f"Rebuilt acuity rollups from {total} reports")
+    await close_database_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
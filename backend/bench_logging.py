@@ -0,0 +1,59 @@
+"""Latency the per-utterance logging adds to the event loop: INFO vs off.
+
+Runs a fake utterance handler that logs like handle_voice_message (three
+INFO records, two of them sampled) under several logging setups, and times
+each handler call on the loop. Log output goes to os.devnull.
+
+Usage: python bench_logging.py [--utterances 20000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from bench_utils import format_latencies
+from logging_config import bind_session_id, configure_logging
+
+logger = logging.getLogger("bench")
+
+async def handle_utterance(index: int):
+    text = f"utterance {index}"
+    logger.info("[VOICE] Processing cleaned text: '%s'", text, extra={"sample": "voice.utterance"})
+    logger.info("[VOICE] Matched Command: '%s' vs Expected: '%s'", "up", "up", extra={"sample": "voice.match"})
+    logger.info("[VOICE] Answer recorded for %s", text)
+
+async def run(utterances: int):
+    bind_session_id()
+    samples = []
+    for index in range(utterances):
+        started = time.perf_counter()
+        await handle_utterance(index)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def synchronous_logging(devnull):
+    # The previous setup: basicConfig formatting and writing on the loop
+    root = logging.getLogger()
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    root.handlers[:] = [handler]
+    root.setLevel(logging.INFO)
+
+def main(args):
+    with open(os.devnull, "w") as devnull:
+        setups = [
+            ("off (level WARNING)", lambda: configure_logging("WARNING", "json", devnull)),
+            ("INFO, sampled, queued JSON", lambda: configure_logging("INFO", "json", devnull)),
+            ("INFO, synchronous stream", lambda: synchronous_logging(devnull)),
+        ]
+        for name, setup in setups:
+            listener = setup()
+            samples = asyncio.run(run(args.utterances))
+            if listener is not None:
+                listener.stop()
+            print(format_latencies(name, samples))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--utterances", type=int, default=20000)
+    main(parser.parse_args())
@@ -0,0 +1,131 @@
+"""Per-operation latency and memory of the Mongo and SQLite repositories.
+
+Creates --users users, saves --reports reports for each, then times the
+reads the API does per request. SQLite uses a temporary file; Mongo uses a
+scratch database on MONGODB_URL (dropped afterwards) and is skipped when
+MONGODB_URL is not set. Memory is the RSS of this process before and after
+each backend, which includes SQLite's page cache but not mongod's; pass
+--mongod-pid to report mongod's RSS as well.
+
+Usage: python bench_storage.py [--users 200] [--reports 20] [--backends sqlite,mongo]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from bench_utils import format_latencies, rss_mb
+from repository import MongoUserRepository, SQLiteUserRepository
+from rollups import SCOPE_DAILY, SCOPE_USER_DAILY
+
+ACUITIES = [("6/60", 0.1), ("6/24", 0.25), ("6/12", 0.5), ("6/9", 0.67), ("6/6", 1.0), ("6/5", 1.2)]
+
+def user_doc(index: int) -> dict:
+    now = datetime.utcnow()
+    return {
+        "email": f"bench{index}@example.com",
+        "full_name": f"Bench Patient {index}",
+        "hashed_password": "not-a-real-hash",
+        "is_active": True,
+        "created_at": now,
+        "updated_at": now,
+        "test_history": [],
+    }
+
+def report(index: int) -> dict:
+    final_acuity, decimal_acuity = random.choice(ACUITIES)
+    return {
+        "test_type": "LandoltC",
+        "final_acuity": final_acuity,
+        "decimal_acuity": decimal_acuity,
+        "history": [{"acuity": acuity, "couldSee": True} for acuity, _ in ACUITIES[:4]],
+        "timestamp": datetime.utcnow() - timedelta(days=index % 30),
+    }
+
+async def timed(samples: dict, name: str, coro):
+    started = time.perf_counter()
+    result = await coro
+    samples.setdefault(name, []).append(time.perf_counter() - started)
+    return result
+
+async def run(repo, args) -> dict:
+    await repo.ensure_indexes()
+    samples = {}
+    user_ids = []
+    for index in range(args.users):
+        user_ids.append(await timed(samples, "create_user", repo.create_user(user_doc(index))))
+    for index in range(args.reports):
+        for user_id in user_ids:
+            await timed(samples, "append_report", repo.append_report(user_id, report(index)))
+    for index, user_id in enumerate(user_ids):
+        email = f"bench{index}@example.com"
+        await timed(samples, "find_by_email", repo.find_by_email(email))
+        await timed(samples, "find_by_id", repo.find_by_id(user_id))
+        await timed(samples, "get_history(limit=10)", repo.get_history(user_id, 10))
+        await timed(samples, "update_calibration", repo.update_calibration(
+            email, {"focal_length": 600.0 + index, "updated_at": datetime.utcnow()}
+        ))
+        await timed(samples, "get_rollups(user_daily)", repo.get_rollups(SCOPE_USER_DAILY, user_id=str(user_id)))
+    for _ in range(20):
+        await timed(samples, "get_rollups(daily)", repo.get_rollups(SCOPE_DAILY))
+    await timed(samples, "rebuild_rollups", repo.rebuild_rollups())
+    return samples
+
+def bench_sqlite(args, workdir):
+    return SQLiteUserRepository(os.path.join(workdir, "bench.db")), None
+
+def bench_mongo(args, workdir):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(args.mongodb_url)
+    database = client.visual_acuity_bench
+
+    async def cleanup():
+        await client.drop_database("visual_acuity_bench")
+
+    return MongoUserRepository(database.users, database.acuity_rollups, client), cleanup
+
+async def bench(name, factory, args, workdir):
+    repo, cleanup = factory(args, workdir)
+    try:
+        if cleanup is not None:
+            await cleanup()
+        rss_before = rss_mb()
+        samples = await run(repo, args)
+        rss_after = rss_mb()
+    finally:
+        if cleanup is not None:
+            await cleanup()
+        await repo.close()
+
+    print(f"== {name}: {args.users} users x {args.reports} reports")
+    for operation, operation_samples in samples.items():
+        print(format_latencies(operation, operation_samples))
+    if rss_before is not None:
+        print(f"client RSS: {rss_before:.1f} -> {rss_after:.1f} MiB")
+    if name == "mongo" and args.mongod_pid:
+        print(f"mongod RSS: {rss_mb(args.mongod_pid)} MiB")
+    if name == "sqlite":
+        size = sum(
+            os.path.getsize(os.path.join(workdir, f)) for f in os.listdir(workdir) if f.startswith("bench.db")
+        )
+        print(f"database files: {size / 1024 / 1024:.1f} MiB")
+
+def main(args):
+    factories = {"sqlite": bench_sqlite, "mongo": bench_mongo}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.backends.split(","):
+            if name == "mongo" and not args.mongodb_url:
+                print("== mongo: skipped, MONGODB_URL is not set")
+                continue
+            asyncio.run(bench(name, factories[name], args, workdir))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--reports", type=int, default=20, help="reports saved per user")
+    parser.add_argument("--backends", default="sqlite,mongo")
+    parser.add_argument("--mongodb-url", default=os.getenv("MONGODB_URL"))
+    parser.add_argument("--mongod-pid", type=int, help="also report this mongod's RSS")
+    main(parser.parse_args())
@@ -0,0 +1,37 @@
+"""Helpers shared by the benchmark and load-test scripts."""
+import os
+import statistics
+from typing import List, Optional
+
+def percentile(sorted_samples: List[float], fraction: float) -> float:
+    index = min(int(round(fraction * (len(sorted_samples) - 1))), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+def format_latencies(name: str, samples: List[float]) -> str:
+    """One report line for latencies given in seconds, shown in milliseconds."""
+    if not samples:
+        return f"{name:<28} no samples"
+    ordered = sorted(samples)
+    ms = lambda value: f"{value * 1000:8.3f}"
+    return (
+        f"{name:<28} n={len(ordered):<6} mean={ms(statistics.fmean(ordered))} "
+        f"p50={ms(percentile(ordered, 0.5))} p95={ms(percentile(ordered, 0.95))} "
+        f"p99={ms(percentile(ordered, 0.99))} max={ms(ordered[-1])} ms"
+    )
+
+def rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """Resident memory of a process (default: this one) in MiB, or None if unavailable."""
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid is None:
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except ImportError:
+            pass
+    return None
@@ -0,0 +1,55 @@
+"""Repository fixture shared by the backend tests.
+
+Every test taking ``repo`` runs once against Mongo (through mongomock-motor,
+skipped when it is not installed) and once against SQLite (tmp_path file).
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from repository import MongoUserRepository, SQLiteUserRepository
+
+DAY = datetime(2024, 3, 1, 9, 30)
+
+def run(coro):
+    return asyncio.run(coro)
+
+@pytest.fixture(params=["mongo", "sqlite"])
+def repo(request, tmp_path):
+    if request.param == "mongo":
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        database = mongomock_motor.AsyncMongoMockClient().visual_acuity_test
+        repository = MongoUserRepository(database.users, database.acuity_rollups)
+    else:
+        repository = SQLiteUserRepository(str(tmp_path / "visual_acuity.db"))
+    run(repository.ensure_indexes())
+    yield repository
+    run(repository.close())
+
+def user_doc(email="patient@example.com"):
+    now = datetime.utcnow()
+    return {
+        "email": email,
+        "full_name": "Test Patient",
+        "hashed_password": "not-a-real-hash",
+        "focal_length": None,
+        "pixels_per_mm": None,
+        "screen_ppi": None,
+        "is_active": True,
+        "created_at": now,
+        "updated_at": now,
+        "test_history": [],
+    }
+
+def report(decimal_acuity=1.0, final_acuity="6/6", timestamp=DAY, test_type="LandoltC"):
+    return {
+        "test_type": test_type,
+        "final_acuity": final_acuity,
+        "decimal_acuity": decimal_acuity,
+        "history": [{"acuity": "6/12", "couldSee": True}, {"acuity": final_acuity, "couldSee": True}],
+        "timestamp": timestamp,
+    }
+
+def create(repo, email="patient@example.com"):
+    return run(repo.create_user(user_doc(email)))
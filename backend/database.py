@@ -1,22 +1,29 @@
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
 from dotenv import load_dotenv
+from repository import MongoUserRepository, SQLiteUserRepository
 
 load_dotenv()
 
+# "mongo" (default) or "sqlite" for stand-alone kiosks without a mongod
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo").lower()
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017/face_detection_db")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "visual_acuity.db")
 
-# Async client for FastAPI
-motor_client = AsyncIOMotorClient(MONGODB_URL)
-database = motor_client.get_default_database()
+if STORAGE_BACKEND == "sqlite":
+    users_repository = SQLiteUserRepository(SQLITE_PATH)
+elif STORAGE_BACKEND == "mongo":
+    from motor.motor_asyncio import AsyncIOMotorClient
 
-# Collections
-users_collection = database.users
+    # Async client for FastAPI
+    motor_client = AsyncIOMotorClient(MONGODB_URL)
+    database = motor_client.get_default_database()
 
-# Sync client for testing/initialization
-sync_client = MongoClient(MONGODB_URL)
-sync_db = sync_client.get_default_database()
+    # Collections
+    users_collection = database.users
+    rollups_collection = database.acuity_rollups
+    users_repository = MongoUserRepository(users_collection, rollups_collection, client=motor_client)
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (expected 'mongo' or 'sqlite')")
 
 async def close_database_connection():
-    motor_client.close()
\ No newline at end of file
+    await users_repository.close()
@@ -0,0 +1,88 @@
+"""Open N authenticated /ws_session sessions against a running server and hold them.
+
+Reports how many sessions the server held at once, connect+auth latency,
+control-channel round trips while all sessions are open, and (with --pid,
+on the same host) the server's resident memory.
+
+Usage: python loadtest_sessions.py --sessions 1000 --hold 10 [--url http://localhost:8000] [--pid <server pid>]
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.request
+import websockets
+from bench_utils import format_latencies, rss_mb
+
+def http_json(url, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def get_token(base_url, email, password):
+    credentials = {"email": email, "password": password}
+    try:
+        return http_json(f"{base_url}/auth/login", credentials)["access_token"]
+    except urllib.error.HTTPError:
+        return http_json(f"{base_url}/auth/register", {**credentials, "full_name": "Load Test"})["access_token"]
+
+async def open_session(ws_url, connect_times):
+    started = time.perf_counter()
+    websocket = await websockets.connect(ws_url, max_size=None)
+    reply = json.loads(await websocket.recv())
+    if reply.get("status") != "authenticated":
+        await websocket.close()
+        raise RuntimeError(reply.get("error", "authentication failed"))
+    connect_times.append(time.perf_counter() - started)
+    return websocket
+
+async def ping(websocket, ping_times):
+    started = time.perf_counter()
+    await websocket.send(json.dumps({"channel": "control", "command": "ping"}))
+    await websocket.recv()
+    ping_times.append(time.perf_counter() - started)
+
+async def main(args):
+    token = get_token(args.url, args.email, args.password)
+    ws_url = args.url.replace("http", "ws", 1) + f"/ws_session?token={token}"
+    baseline_rss = rss_mb(args.pid) if args.pid else None
+
+    connect_times, ping_times, sessions, failures = [], [], [], 0
+    for start in range(0, args.sessions, args.concurrency):
+        batch = range(start, min(start + args.concurrency, args.sessions))
+        results = await asyncio.gather(*(open_session(ws_url, connect_times) for _ in batch), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                failures += 1
+            else:
+                sessions.append(result)
+
+    held = http_json(f"{args.url}/health")["active_sessions"]
+    deadline = time.perf_counter() + args.hold
+    while time.perf_counter() < deadline:
+        await asyncio.gather(*(ping(websocket, ping_times) for websocket in sessions), return_exceptions=True)
+        await asyncio.sleep(1)
+
+    print(f"sessions requested={args.sessions} opened={len(sessions)} failed={failures} held by server={held}")
+    print(format_latencies("connect + auth", connect_times))
+    print(format_latencies("control ping under load", ping_times))
+    if args.pid:
+        loaded_rss = rss_mb(args.pid)
+        if baseline_rss is not None and loaded_rss is not None:
+            per_session = (loaded_rss - baseline_rss) * 1024 / max(len(sessions), 1)
+            print(f"server RSS {baseline_rss:.1f} -> {loaded_rss:.1f} MiB (~{per_session:.1f} KiB/session)")
+
+    await asyncio.gather(*(websocket.close() for websocket in sessions), return_exceptions=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50, help="sessions opened at a time")
+    parser.add_argument("--hold", type=float, default=10.0, help="seconds to keep all sessions open")
+    parser.add_argument("--email", default="loadtest@example.com")
+    parser.add_argument("--password", default="loadtest-password")
+    parser.add_argument("--pid", type=int, help="server process id, to report its memory")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,121 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Correlation id of the WebSocket session the current task is serving
+session_id_var = contextvars.ContextVar("session_id", default=None)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+# Per-frame/per-utterance records tagged with extra={"sample": "<event>"} are
+# limited to this many per second for each (event, session) pair
+SAMPLED_LOG_RATE = int(os.getenv("SAMPLED_LOG_RATE", "5"))
+
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+def bind_session_id(session_id: Optional[str] = None) -> str:
+    """Tag every record logged by the current task with a session id."""
+    session_id = session_id or uuid.uuid4().hex
+    session_id_var.set(session_id)
+    return session_id
+
+class SessionIdFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, "session_id"):
+            record.session_id = session_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Rate-limits records tagged with a "sample" event name.
+
+    Runs before the record is formatted or queued, so dropped records cost
+    almost nothing. The next record let through reports how many were dropped.
+    """
+
+    def __init__(self, rate: int = SAMPLED_LOG_RATE, window: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.window = window
+        self._windows = {}
+
+    def filter(self, record):
+        event = getattr(record, "sample", None)
+        if event is None:
+            return True
+        if self.rate <= 0:
+            return False
+
+        key = (event, getattr(record, "session_id", None))
+        now = time.monotonic()
+        started, count, suppressed = self._windows.get(key, (now, 0, 0))
+        if now - started >= self.window:
+            started, count = now, 0
+        if count >= self.rate:
+            self._windows[key] = (started, count, suppressed + 1)
+            return False
+
+        if suppressed:
+            record.suppressed = suppressed
+        if len(self._windows) > 10000:
+            self._windows.clear()
+        self._windows[key] = (started, count + 1, 0)
+        return True
+
+class DeferredQueueHandler(QueueHandler):
+    """Enqueues records untouched.
+
+    The stdlib prepare() formats the message (and any traceback) on the
+    logging thread, which here is the event loop, and drops exc_info. Leaving
+    the record alone moves all formatting to the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, stream=None) -> QueueListener:
+    """Route all logging through a queue drained by a background thread.
+
+    The event loop only builds the record and enqueues it; formatting and
+    writing to the stream (stderr by default) happen on the listener thread.
+    Call stop() on the returned listener at shutdown to flush it.
+    """
+    stream_handler = logging.StreamHandler(stream)
+    if fmt == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(session_id)s] %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SessionIdFilter())
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field, conint, confloat
+from typing import Literal, Optional, List
 from datetime import datetime
 from bson import ObjectId
 
@@ -97,4 +97,21 @@ class TokenData(BaseModel):
 class CalibrationData(BaseModel):
     focal_length: Optional[float] = None
     pixels_per_mm: Optional[float] = None
-    screen_ppi: Optional[float] = None
\ No newline at end of file
+    screen_ppi: Optional[float] = None
+
+class ProfileRequest(BaseModel):
+    mode: Literal["sample", "cprofile"] = "sample"
+    frames: Optional[conint(gt=0)] = None
+    seconds: Optional[confloat(gt=0)] = None
+    session_id: Optional[str] = None  # None profiles the whole process
+    # The sampler thread competes with the event loop for the GIL, so keep it >= 1 ms
+    interval_ms: confloat(ge=1.0, le=1000.0) = 5.0
+
+class ProfileResult(BaseModel):
+    mode: str
+    session_id: Optional[str] = None
+    frames: int
+    duration: float
+    collapsed_stacks: str
+    top_allocations: str
+    allocations_scope: str = "process"  # tracemalloc sees the whole process, even for one session
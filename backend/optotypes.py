@@ -0,0 +1,70 @@
+import hashlib
+import json
+import math
+from collections import OrderedDict
+from typing import Optional
+
+# Snellen levels used by the Landolt C test, best to worst
+ACUITY_LEVELS = ["6/3", "6/4", "6/5", "6/6", "6/8", "6/9", "6/12", "6/18", "6/24"]
+DEFAULT_SCREEN_PPI = 96.0
+MM_PER_INCH = 25.4
+# A 6/6 Landolt C subtends 5 arcminutes; its gap is a fifth of that
+OPTOTYPE_ARCMIN = 5.0
+MAX_CACHED_LADDERS = 1024
+
+def resolve_pixels_per_mm(screen_ppi: Optional[float], pixels_per_mm: Optional[float]) -> float:
+    if screen_ppi and screen_ppi > 0:
+        return screen_ppi / MM_PER_INCH
+    if pixels_per_mm and pixels_per_mm > 0:
+        return pixels_per_mm
+    return DEFAULT_SCREEN_PPI / MM_PER_INCH
+
+def compute_ladder(px_per_mm: float, distance_m: float) -> dict:
+    distance_mm = distance_m * 1000
+    standard_size_mm = 2 * distance_mm * math.tan(math.radians(OPTOTYPE_ARCMIN / 60) / 2)
+    levels = []
+    for acuity in ACUITY_LEVELS:
+        numerator, denominator = (float(part) for part in acuity.split("/"))
+        size_mm = standard_size_mm * denominator / numerator
+        levels.append({
+            "acuity": acuity,
+            "decimal_acuity": round(numerator / denominator, 3),
+            "logmar": round(math.log10(denominator / numerator), 3),
+            "size_mm": round(size_mm, 4),
+            "gap_mm": round(size_mm / 5, 4),
+            "size_px": round(size_mm * px_per_mm, 2),
+            "gap_px": round(size_mm / 5 * px_per_mm, 2),
+        })
+    return {"distance_m": distance_m, "pixels_per_mm": round(px_per_mm, 4), "levels": levels}
+
+# user id -> (calibration key, etag, rendered JSON body)
+_ladder_cache = OrderedDict()
+
+def get_ladder(user_id: str, screen_ppi, pixels_per_mm, distance_m: float):
+    """Return (etag, JSON body) for a user's ladder, computing it once per calibration."""
+    key = (screen_ppi, pixels_per_mm, distance_m)
+    cached = _ladder_cache.get(user_id)
+    # The key check also catches calibrations updated by another worker process
+    if cached and cached[0] == key:
+        _ladder_cache.move_to_end(user_id)
+        return cached[1], cached[2]
+
+    ladder = compute_ladder(resolve_pixels_per_mm(screen_ppi, pixels_per_mm), distance_m)
+    body = json.dumps(ladder, separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    _ladder_cache[user_id] = (key, etag, body)
+    if len(_ladder_cache) > MAX_CACHED_LADDERS:
+        _ladder_cache.popitem(last=False)
+    return etag, body
+
+def invalidate_ladder(user_id: str):
+    _ladder_cache.pop(user_id, None)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header (RFC 9110 13.1.2) against our etag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    strip_weak = lambda tag: tag[2:] if tag.startswith("W/") else tag
+    return strip_weak(etag) in (strip_weak(tag.strip()) for tag in if_none_match.split(","))
@@ -0,0 +1,170 @@
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+MAX_PROFILE_SECONDS = 300
+TOP_ALLOCATIONS = 25
+
+# The run currently collecting data, if any. Hot paths only check this for None.
+active_run = None
+
+def _label(filename, name):
+    return f"{os.path.basename(filename)}:{name}" if filename != "~" else name
+
+class ProfileRun:
+    """One on-demand profiling window, limited by frame count and/or seconds.
+
+    With a session_id only frames of that session are profiled, otherwise
+    everything the event loop does during the window is. tracemalloc cannot
+    attribute memory to a session, so allocations are always process-wide.
+    """
+
+    def __init__(self, mode="sample", frames=None, seconds=None, session_id=None, interval=0.005):
+        self.mode = mode
+        self.max_frames = frames
+        self.seconds = seconds
+        self.session_id = session_id
+        self.interval = interval
+        self.frames = 0
+        self.duration = 0.0
+        self.stacks = Counter()
+        self.top_allocations = ""
+        self.done = asyncio.Event()
+        self._in_scope = session_id is None
+        self._loop_thread = threading.get_ident()
+        self._profile = None
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+        self._owns_tracemalloc = False
+        self._started_at = 0.0
+        self._stopped = False
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            self._owns_tracemalloc = True
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            if self.session_id is None:
+                self._profile.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    def enter(self, session_id) -> bool:
+        """Called before a frame/utterance is handled; returns whether it is profiled."""
+        # Once the frame limit is reached nothing more is profiled, even
+        # before wait() gets to resume and stop the run
+        if self._stopped or self.done.is_set():
+            return False
+        if self.session_id is not None:
+            if session_id != self.session_id:
+                return False
+            self._in_scope = True
+            if self._profile is not None:
+                self._profile.enable()
+        return True
+
+    def exit(self):
+        if self.session_id is not None:
+            self._in_scope = False
+            if self._profile is not None:
+                self._profile.disable()
+        self.frames += 1
+        if self.max_frames and self.frames >= self.max_frames:
+            self.done.set()
+
+    async def wait(self):
+        timeout = min(self.seconds or MAX_PROFILE_SECONDS, MAX_PROFILE_SECONDS)
+        try:
+            await asyncio.wait_for(self.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        global active_run
+        if self._stopped:
+            return
+        self._stopped = True
+        if active_run is self:
+            active_run = None
+        self.duration = time.perf_counter() - self._started_at
+
+        if self._profile is not None:
+            self._profile.disable()
+            self._collapse_cprofile()
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+        stats = snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        self.top_allocations = "\n".join(str(stat) for stat in stats)
+
+    def _sample_loop(self):
+        while not self._stop_sampling.wait(self.interval):
+            if not self._in_scope:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = []
+            while frame is not None:
+                stack.append(_label(frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def _collapse_cprofile(self):
+        # cProfile only records caller/callee edges, so each function's own
+        # time is attributed to its most expensive call path (in microseconds).
+        stats = pstats.Stats(self._profile).stats
+        for func, (_, _, tottime, _, _) in stats.items():
+            weight = int(tottime * 1e6)
+            if weight <= 0:
+                continue
+            path, current = [func], func
+            while True:
+                callers = stats.get(current, (0, 0, 0, 0, {}))[4]
+                if not callers:
+                    break
+                parent = max(callers, key=lambda c: callers[c][3] if isinstance(callers[c], tuple) else callers[c])
+                if parent in path:
+                    break
+                path.append(parent)
+                current = parent
+            self.stacks[";".join(_label(f[0], f[2]) for f in reversed(path))] += weight
+
+    def collapsed_stacks(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+def start_run(**kwargs) -> ProfileRun:
+    global active_run
+    if active_run is not None:
+        raise RuntimeError("A profiling run is already in progress")
+    active_run = ProfileRun(**kwargs)
+    active_run.start()
+    return active_run
+
+async def run_profiled(session_id, handler, *args):
+    """Await handler(*args), profiling it if a run is active and in scope."""
+    run = active_run
+    if run is None or not run.enter(session_id):
+        return await handler(*args)
+    try:
+        return await handler(*args)
+    finally:
+        run.exit()
@@ -0,0 +1,517 @@
+import asyncio
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+from urllib.parse import unquote
+from bson import ObjectId
+from pymongo import UpdateOne
+from rollups import RollupDeltas, summarize
+
+class UserRepository(ABC):
+    """Persistence operations used by the API.
+
+    Users are returned as plain documents shaped like the Mongo ones
+    (``_id`` as ObjectId, embedded ``test_history``) so they can be fed
+    straight into ``UserInDB``/``User``.
+    """
+
+    @abstractmethod
+    async def find_by_email(self, email: str) -> Optional[dict]:
+        """Return the user with this email, or None."""
+
+    @abstractmethod
+    async def find_by_id(self, user_id: ObjectId) -> Optional[dict]:
+        """Return the user with this id, or None."""
+
+    @abstractmethod
+    async def create_user(self, user_doc: dict) -> ObjectId:
+        """Insert a new user; reports must be added with append_report so rollups stay in step."""
+
+    @abstractmethod
+    async def update_calibration(self, email: str, update_data: dict) -> Optional[dict]:
+        """Set calibration fields of the user with this email and return the updated user."""
+
+    @abstractmethod
+    async def append_report(self, user_id: ObjectId, report: dict) -> Optional[dict]:
+        """Append a report to the user's history and return the updated user, or None if no such user."""
+
+    @abstractmethod
+    async def get_history(self, user_id: ObjectId, limit: Optional[int] = None) -> List[dict]:
+        """Return the user's reports, most recent first."""
+
+    @abstractmethod
+    async def get_rollups(self, scope: str, test_type: Optional[str] = None, user_id: Optional[str] = None,
+                          start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+        """Return acuity rollups of a scope, oldest day first; start/end are inclusive ISO dates."""
+
+    @abstractmethod
+    async def rebuild_rollups(self, batch_size: int = 500) -> int:
+        """Recompute all rollups from the stored reports and return how many were read."""
+
+    @staticmethod
+    def _check_new_user(user_doc: dict):
+        if user_doc.get("test_history"):
+            raise ValueError("New users cannot carry test_history; save reports with append_report")
+
+    async def ensure_indexes(self):
+        pass
+
+    async def close(self):
+        pass
+
+# --- MongoDB (Motor) ---
+def _histogram_field(acuity: str) -> str:
+    # Mongo field names may not contain dots, start with "$" or be empty.
+    # Percent-encoding (and a lone "%" for "") lets get_rollups restore the label.
+    return acuity.replace("%", "%25").replace(".", "%2E").replace("$", "%24") or "%"
+
+def _histogram_label(field: str) -> str:
+    return "" if field == "%" else unquote(field)
+
+class MongoUserRepository(UserRepository):
+    """Users with embedded test_history, plus an acuity_rollups collection.
+
+    On a replica set or mongos, a report and its rollup increments are
+    written in one transaction. A standalone mongod has no transactions, so
+    if the rollup write fails after the $push, backfill_rollups.py is how
+    the rollups are brought back in line.
+    """
+
+    def __init__(self, collection, rollups_collection, client=None):
+        self.collection = collection
+        self.rollups_collection = rollups_collection
+        self.client = client
+        # Set by ensure_indexes() once the server topology is known
+        self.use_transactions = False
+
+    async def find_by_email(self, email):
+        return await self.collection.find_one({"email": email})
+
+    async def find_by_id(self, user_id):
+        return await self.collection.find_one({"_id": ObjectId(user_id)})
+
+    async def create_user(self, user_doc):
+        self._check_new_user(user_doc)
+        result = await self.collection.insert_one(user_doc)
+        return result.inserted_id
+
+    async def update_calibration(self, email, update_data):
+        await self.collection.update_one({"email": email}, {"$set": update_data})
+        return await self.collection.find_one({"email": email})
+
+    async def append_report(self, user_id, report):
+        if not self.use_transactions:
+            return await self._append_report(user_id, report)
+        async with await self.client.start_session() as session:
+            async with session.start_transaction():
+                return await self._append_report(user_id, report, session)
+
+    async def _append_report(self, user_id, report, session=None):
+        # Server-side write time; rebuild_rollups uses it as its watermark
+        # because report timestamps may come from the client
+        report = {**report, "saved_at": datetime.utcnow()}
+        update_result = await self.collection.update_one(
+            {"_id": ObjectId(user_id)},
+            {"$push": {"test_history": report}},
+            session=session
+        )
+        if update_result.matched_count == 0:
+            return None
+        deltas = RollupDeltas()
+        deltas.add(user_id, report)
+        await self._apply_rollups(deltas, session=session)
+        return await self.collection.find_one({"_id": ObjectId(user_id)}, session=session)
+
+    async def get_history(self, user_id, limit=None):
+        user_data = await self.collection.find_one({"_id": ObjectId(user_id)}, {"test_history": 1})
+        if not user_data:
+            return []
+        history = list(reversed(user_data.get("test_history", [])))
+        return history[:limit] if limit else history
+
+    async def _apply_rollups(self, deltas: RollupDeltas, collection=None, session=None):
+        operations = []
+        for (scope, day, test_type, user_id), delta in deltas.deltas.items():
+            increments = {"count": delta["count"], "sum": delta["sum"], "sum_sq": delta["sum_sq"]}
+            increments.update({
+                f"histogram.{_histogram_field(acuity)}": count for acuity, count in delta["histogram"].items()
+            })
+            operations.append(UpdateOne(
+                {"scope": scope, "user_id": user_id, "test_type": test_type, "day": day},
+                {"$inc": increments, "$min": {"min": delta["min"]}, "$max": {"max": delta["max"]}},
+                upsert=True
+            ))
+        if operations:
+            # Motor collections refuse truth-testing, so compare with None
+            target = self.rollups_collection if collection is None else collection
+            await target.bulk_write(operations, ordered=False, session=session)
+
+    async def get_rollups(self, scope, test_type=None, user_id=None, start=None, end=None):
+        query = {"scope": scope}
+        if test_type:
+            query["test_type"] = test_type
+        if user_id:
+            query["user_id"] = str(user_id)
+        if start or end:
+            query["day"] = {}
+            if start:
+                query["day"]["$gte"] = start
+            if end:
+                query["day"]["$lte"] = end
+        cursor = self.rollups_collection.find(query).sort([("day", 1), ("test_type", 1)])
+        rollups = []
+        async for doc in cursor:
+            doc["histogram"] = {_histogram_label(field): count for field, count in doc.get("histogram", {}).items()}
+            rollups.append(summarize(doc["scope"], doc["day"], doc["test_type"], doc.get("user_id"), doc))
+        return rollups
+
+    async def rebuild_rollups(self, batch_size=500):
+        # Rollups are rebuilt into a scratch collection and swapped in with a
+        # rename, so dashboards keep reading the old ones meanwhile. Only
+        # reports saved up to a watermark go into the scratch collection;
+        # reports saved while it is built are added right after the swap.
+        watermark = datetime.utcnow()
+        scratch = self.rollups_collection.database[f"{self.rollups_collection.name}_rebuild"]
+        await scratch.drop()
+
+        total = await self._rollup_reports(scratch, {}, batch_size, lambda ts: ts <= watermark)
+        swapped_at = datetime.utcnow()
+        await scratch.rename(self.rollups_collection.name, dropTarget=True)
+        await self._ensure_rollup_index()
+
+        # Reports saved after the swap were already counted by append_report.
+        # A request in flight across the swap itself can still be counted twice.
+        caught_up = await self._rollup_reports(
+            self.rollups_collection, {"test_history.saved_at": {"$gt": watermark}}, batch_size,
+            lambda ts: watermark < ts <= swapped_at
+        )
+        return total + caught_up
+
+    async def _rollup_reports(self, target, query, batch_size, include):
+        total = 0
+        deltas = RollupDeltas()
+        async for user_data in self.collection.find(query, {"test_history": 1}, batch_size=batch_size):
+            for report in user_data.get("test_history", []):
+                # Reports saved before saved_at existed count as old
+                if include(report.get("saved_at", datetime.min)):
+                    deltas.add(user_data["_id"], report)
+            if len(deltas) >= batch_size:
+                await self._apply_rollups(deltas, collection=target)
+                total += len(deltas)
+                deltas = RollupDeltas()
+        await self._apply_rollups(deltas, collection=target)
+        return total + len(deltas)
+
+    async def _ensure_rollup_index(self):
+        await self.rollups_collection.create_index(
+            [("scope", 1), ("user_id", 1), ("test_type", 1), ("day", 1)], unique=True
+        )
+
+    async def ensure_indexes(self):
+        await self._ensure_rollup_index()
+        await self.collection.create_index("test_history.saved_at")
+        if self.client is not None:
+            hello = await self.client.admin.command("hello")
+            self.use_transactions = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
+
+# --- Embedded SQLite (single-site kiosks) ---
+USER_COLUMNS = (
+    "id", "email", "full_name", "hashed_password", "focal_length", "pixels_per_mm",
+    "screen_ppi", "is_active", "created_at", "updated_at"
+)
+CALIBRATION_COLUMNS = {"focal_length", "pixels_per_mm", "screen_ppi", "updated_at"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    full_name TEXT NOT NULL,
+    hashed_password TEXT NOT NULL,
+    focal_length REAL,
+    pixels_per_mm REAL,
+    screen_ppi REAL,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS test_reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL REFERENCES users(id),
+    test_type TEXT NOT NULL,
+    final_acuity TEXT NOT NULL,
+    decimal_acuity REAL NOT NULL,
+    history TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_test_reports_user ON test_reports(user_id, id);
+"""
+
+# Also created with a "_rebuild" suffix as scratch tables by rebuild_rollups
+ROLLUP_TABLES = ("acuity_rollups", "acuity_rollup_histograms")
+REBUILD_SUFFIX = "_rebuild"
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS acuity_rollups{suffix} (
+    scope TEXT NOT NULL,
+    day TEXT NOT NULL,
+    test_type TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    sum_sq REAL NOT NULL,
+    min REAL,
+    max REAL,
+    PRIMARY KEY (scope, user_id, test_type, day)
+);
+CREATE TABLE IF NOT EXISTS acuity_rollup_histograms{suffix} (
+    scope TEXT NOT NULL,
+    day TEXT NOT NULL,
+    test_type TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    final_acuity TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (scope, user_id, test_type, day, final_acuity)
+);
+"""
+
+class SQLiteUserRepository(UserRepository):
+    """SQLite store in WAL mode.
+
+    All statements run on one connection in a single worker thread, which
+    keeps the event loop free and serialises writes the way SQLite wants.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(SCHEMA + ROLLUP_SCHEMA.format(suffix=""))
+        return conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _reports(self, user_id: str, limit: Optional[int] = None, newest_first: bool = False):
+        query = "SELECT * FROM test_reports WHERE user_id = ? ORDER BY id " + ("DESC" if newest_first else "ASC")
+        params = [user_id]
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [
+            {
+                "test_type": row["test_type"],
+                "final_acuity": row["final_acuity"],
+                "decimal_acuity": row["decimal_acuity"],
+                "history": json.loads(row["history"]),
+                "timestamp": datetime.fromisoformat(row["timestamp"]),
+            }
+            for row in self._conn.execute(query, params)
+        ]
+
+    def _user_doc(self, row) -> Optional[dict]:
+        if row is None:
+            return None
+        doc = {key: row[key] for key in USER_COLUMNS if key != "id"}
+        doc["_id"] = ObjectId(row["id"])
+        doc["is_active"] = bool(row["is_active"])
+        doc["created_at"] = datetime.fromisoformat(row["created_at"])
+        doc["updated_at"] = datetime.fromisoformat(row["updated_at"])
+        doc["test_history"] = self._reports(row["id"])
+        return doc
+
+    def _find_by_email(self, email):
+        row = self._conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+        return self._user_doc(row)
+
+    def _find_by_id(self, user_id):
+        row = self._conn.execute("SELECT * FROM users WHERE id = ?", (str(user_id),)).fetchone()
+        return self._user_doc(row)
+
+    def _create_user(self, user_doc):
+        user_id = user_doc.get("_id") or ObjectId()
+        values = {
+            "id": str(user_id),
+            "email": user_doc["email"],
+            "full_name": user_doc["full_name"],
+            "hashed_password": user_doc["hashed_password"],
+            "focal_length": user_doc.get("focal_length"),
+            "pixels_per_mm": user_doc.get("pixels_per_mm"),
+            "screen_ppi": user_doc.get("screen_ppi"),
+            "is_active": int(user_doc.get("is_active", True)),
+            "created_at": user_doc["created_at"].isoformat(),
+            "updated_at": user_doc["updated_at"].isoformat(),
+        }
+        with self._conn:
+            self._conn.execute(
+                f"INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({', '.join('?' * len(USER_COLUMNS))})",
+                [values[key] for key in USER_COLUMNS]
+            )
+        return ObjectId(values["id"])
+
+    def _update_calibration(self, email, update_data):
+        fields = {key: value for key, value in update_data.items() if key in CALIBRATION_COLUMNS}
+        if "updated_at" in fields:
+            fields["updated_at"] = fields["updated_at"].isoformat()
+        if fields:
+            assignments = ", ".join(f"{key} = ?" for key in fields)
+            with self._conn:
+                self._conn.execute(f"UPDATE users SET {assignments} WHERE email = ?", [*fields.values(), email])
+        return self._find_by_email(email)
+
+    def _append_report(self, user_id, report):
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO test_reports (user_id, test_type, final_acuity, decimal_acuity, history, timestamp) "
+                "SELECT id, ?, ?, ?, ?, ? FROM users WHERE id = ?",
+                (
+                    report["test_type"], report["final_acuity"], report["decimal_acuity"],
+                    json.dumps(report["history"]), report["timestamp"].isoformat(), str(user_id)
+                )
+            )
+            if cursor.rowcount:
+                # Same transaction as the report, so rollups never drift
+                deltas = RollupDeltas()
+                deltas.add(user_id, report)
+                self._apply_rollups(deltas)
+        if cursor.rowcount == 0:
+            return None
+        return self._find_by_id(user_id)
+
+    def _apply_rollups(self, deltas: RollupDeltas, suffix: str = ""):
+        # Must be called inside a transaction
+        for (scope, day, test_type, user_id), delta in deltas.deltas.items():
+            self._conn.execute(
+                f"INSERT INTO acuity_rollups{suffix} (scope, day, test_type, user_id, count, sum, sum_sq, min, max) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (scope, user_id, test_type, day) DO UPDATE SET "
+                "count = count + excluded.count, sum = sum + excluded.sum, sum_sq = sum_sq + excluded.sum_sq, "
+                "min = MIN(min, excluded.min), max = MAX(max, excluded.max)",
+                (scope, day, test_type, user_id, delta["count"], delta["sum"], delta["sum_sq"], delta["min"], delta["max"])
+            )
+            self._conn.executemany(
+                f"INSERT INTO acuity_rollup_histograms{suffix} (scope, day, test_type, user_id, final_acuity, count) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (scope, user_id, test_type, day, final_acuity) DO UPDATE SET count = count + excluded.count",
+                [(scope, day, test_type, user_id, acuity, count) for acuity, count in delta["histogram"].items()]
+            )
+
+    def _get_rollups(self, scope, test_type, user_id, start, end):
+        conditions, params = ["scope = ?"], [scope]
+        for clause, value in (("test_type = ?", test_type), ("user_id = ?", str(user_id) if user_id else None),
+                              ("day >= ?", start), ("day <= ?", end)):
+            if value:
+                conditions.append(clause)
+                params.append(value)
+        where = " AND ".join(conditions)
+
+        histograms = {}
+        for row in self._conn.execute(f"SELECT * FROM acuity_rollup_histograms WHERE {where}", params):
+            key = (row["user_id"], row["test_type"], row["day"])
+            histograms.setdefault(key, {})[row["final_acuity"]] = row["count"]
+
+        rollups = []
+        for row in self._conn.execute(f"SELECT * FROM acuity_rollups WHERE {where} ORDER BY day, test_type", params):
+            stats = dict(row)
+            stats["histogram"] = histograms.get((row["user_id"], row["test_type"], row["day"]), {})
+            rollups.append(summarize(row["scope"], row["day"], row["test_type"], row["user_id"], stats))
+        return rollups
+
+    def _start_rebuild(self):
+        # Scratch tables left behind by an interrupted rebuild are discarded
+        self._conn.executescript(
+            "".join(f"DROP TABLE IF EXISTS {table}{REBUILD_SUFFIX};" for table in ROLLUP_TABLES)
+            + ROLLUP_SCHEMA.format(suffix=REBUILD_SUFFIX)
+        )
+        return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM test_reports").fetchone()[0]
+
+    def _report_deltas(self, after_id, until_id=None, batch_size=None):
+        query = "SELECT id, user_id, test_type, final_acuity, decimal_acuity, timestamp FROM test_reports WHERE id > ?"
+        params = [after_id]
+        if until_id is not None:
+            query += " AND id <= ?"
+            params.append(until_id)
+        query += " ORDER BY id"
+        if batch_size:
+            query += " LIMIT ?"
+            params.append(batch_size)
+        rows = self._conn.execute(query, params).fetchall()
+        deltas = RollupDeltas()
+        for row in rows:
+            deltas.add(row["user_id"], {
+                "test_type": row["test_type"],
+                "final_acuity": row["final_acuity"],
+                "decimal_acuity": row["decimal_acuity"],
+                "timestamp": datetime.fromisoformat(row["timestamp"]),
+            })
+        return deltas, rows[-1]["id"] if rows else until_id
+
+    def _rollup_batch(self, after_id, until_id, batch_size):
+        deltas, last_id = self._report_deltas(after_id, until_id, batch_size)
+        with self._conn:
+            self._apply_rollups(deltas, REBUILD_SUFFIX)
+        return len(deltas), last_id
+
+    def _swap_rollups(self, until_id):
+        # Runs on the single SQLite thread, so no report can be saved between
+        # the catch-up and the swap; readers see the old or the new rollups.
+        deltas, _ = self._report_deltas(until_id)
+        with self._conn:
+            self._apply_rollups(deltas, REBUILD_SUFFIX)
+            for table in ROLLUP_TABLES:
+                self._conn.execute(f"DELETE FROM {table}")
+                self._conn.execute(f"INSERT INTO {table} SELECT * FROM {table}{REBUILD_SUFFIX}")
+        for table in ROLLUP_TABLES:
+            self._conn.execute(f"DROP TABLE {table}{REBUILD_SUFFIX}")
+        return len(deltas)
+
+    async def find_by_email(self, email):
+        return await self._run(self._find_by_email, email)
+
+    async def find_by_id(self, user_id):
+        return await self._run(self._find_by_id, user_id)
+
+    async def create_user(self, user_doc):
+        self._check_new_user(user_doc)
+        return await self._run(self._create_user, user_doc)
+
+    async def update_calibration(self, email, update_data):
+        return await self._run(self._update_calibration, email, update_data)
+
+    async def append_report(self, user_id, report):
+        return await self._run(self._append_report, user_id, report)
+
+    async def get_history(self, user_id, limit=None):
+        return await self._run(self._reports, str(user_id), limit, True)
+
+    async def get_rollups(self, scope, test_type=None, user_id=None, start=None, end=None):
+        return await self._run(self._get_rollups, scope, test_type, user_id, start, end)
+
+    async def rebuild_rollups(self, batch_size=500):
+        # Like the Mongo path: batches go into scratch tables while the live
+        # rollups keep serving reads, then everything is swapped in at once.
+        # Reports saved meanwhile get ids above until_id and are added to the
+        # scratch tables in the same transaction as the swap.
+        until_id = await self._run(self._start_rebuild)
+        total, last_id = 0, 0
+        while last_id < until_id:
+            count, last_id = await self._run(self._rollup_batch, last_id, until_id, batch_size)
+            total += count
+        return total + await self._run(self._swap_rollups, until_id)
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
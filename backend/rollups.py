@@ -0,0 +1,69 @@
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# Rollup scopes: clinic-wide per day/test type, and per user per day/test type
+SCOPE_DAILY = "daily"
+SCOPE_USER_DAILY = "user_daily"
+ROLLUP_SCOPES = (SCOPE_DAILY, SCOPE_USER_DAILY)
+
+# (scope, day, test_type, user_id); user_id is "" for clinic-wide rollups
+RollupKey = Tuple[str, str, str, str]
+
+def rollup_keys(user_id, report: dict):
+    day = report["timestamp"].date().isoformat()
+    test_type = report["test_type"]
+    return [
+        (SCOPE_DAILY, day, test_type, ""),
+        (SCOPE_USER_DAILY, day, test_type, str(user_id)),
+    ]
+
+class RollupDeltas:
+    """Increments for a batch of reports, merged per rollup key.
+
+    Counts, sums and sums of squares only ever add up, so a delta can be
+    applied to a stored rollup with plain increments in any order.
+    """
+
+    def __init__(self):
+        self.deltas: Dict[RollupKey, dict] = {}
+        self.reports = 0
+
+    def add(self, user_id, report: dict):
+        value = float(report["decimal_acuity"])
+        for key in rollup_keys(user_id, report):
+            delta = self.deltas.get(key)
+            if delta is None:
+                delta = self.deltas[key] = {
+                    "count": 0, "sum": 0.0, "sum_sq": 0.0,
+                    "min": value, "max": value, "histogram": Counter()
+                }
+            delta["count"] += 1
+            delta["sum"] += value
+            delta["sum_sq"] += value * value
+            delta["min"] = min(delta["min"], value)
+            delta["max"] = max(delta["max"], value)
+            delta["histogram"][report["final_acuity"]] += 1
+        self.reports += 1
+
+    def __len__(self):
+        return self.reports
+
+def summarize(scope: str, day: str, test_type: str, user_id: Optional[str], stats: dict) -> dict:
+    """Turn stored sums into the mean/variance view returned by the API."""
+    count = stats["count"]
+    mean = stats["sum"] / count if count else 0.0
+    variance = max(stats["sum_sq"] / count - mean * mean, 0.0) if count else 0.0
+    summary = {
+        "scope": scope,
+        "day": day,
+        "test_type": test_type,
+        "count": count,
+        "mean_decimal_acuity": round(mean, 4),
+        "variance_decimal_acuity": round(variance, 6),
+        "min_decimal_acuity": stats.get("min"),
+        "max_decimal_acuity": stats.get("max"),
+        "final_acuity_histogram": dict(stats.get("histogram", {})),
+    }
+    if user_id:
+        summary["user_id"] = user_id
+    return summary
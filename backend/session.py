@@ -0,0 +1,57 @@
+import uuid
+from collections import deque
+from typing import Dict, Optional
+from models import User
+
+# Channels multiplexed over a single /ws_session connection
+CHANNEL_CONTROL = "control"
+CHANNEL_FRAMES = "frames"
+CHANNEL_VOICE = "voice"
+
+class TestSession:
+    """State shared by the frame, voice and control channels of one test."""
+
+    def __init__(self, user: Optional[User], pause_detection_on_answer: bool = True):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        # Face detection / distance measurement
+        self.focal_length: Optional[float] = None
+        self.calibration_active = False
+        self.distance_measurement_active = False
+        self.previous_distances = deque(maxlen=5)
+        # Voice
+        self.current_symbol: Optional[str] = None
+        self.pause_detection_on_answer = pause_detection_on_answer
+        self.last_process_time = 0.0
+        self.frames_processed = 0
+        self.frames_skipped = 0
+
+    @property
+    def detection_paused(self) -> bool:
+        # Face detection is not needed while the patient is answering
+        return self.pause_detection_on_answer and self.current_symbol is not None
+
+# Sessions currently held by this process, keyed by session id
+active_sessions: Dict[str, TestSession] = {}
+
+def open_session(user: Optional[User]) -> TestSession:
+    session = TestSession(user)
+    active_sessions[session.id] = session
+    return session
+
+def close_session(session: TestSession):
+    active_sessions.pop(session.id, None)
+
+# Detection state of closed /ws connections, per user. Old clients reconnect
+# /ws and expect measurement to carry on, as it did when this state was global.
+DETECTION_FIELDS = ("focal_length", "calibration_active", "distance_measurement_active")
+_suspended_detection: Dict[str, dict] = {}
+
+def suspend_detection(session: TestSession):
+    if session.user is not None:
+        _suspended_detection[str(session.user.id)] = {field: getattr(session, field) for field in DETECTION_FIELDS}
+
+def resume_detection(session: TestSession):
+    if session.user is not None:
+        for field, value in _suspended_detection.pop(str(session.user.id), {}).items():
+            setattr(session, field, value)
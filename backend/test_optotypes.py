@@ -0,0 +1,11 @@
+from optotypes import etag_matches, get_ladder
+
+def test_etag_matches():
+    etag, _ = get_ladder("user", 96.0, None, 4.0)
+    assert etag_matches(etag, etag)
+    assert etag_matches(f"W/{etag}", etag)
+    assert etag_matches(f'"stale", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"stale"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
@@ -0,0 +1,64 @@
+"""Runs the same repository cases against the Mongo and SQLite backends.
+
+Run from backend/ with: python -m pytest -q
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from conftest import DAY, create, report, run, user_doc
+from rollups import SCOPE_DAILY
+
+def test_create_and_find_user(repo):
+    user_id = create(repo)
+    assert isinstance(user_id, ObjectId)
+
+    by_email = run(repo.find_by_email("patient@example.com"))
+    by_id = run(repo.find_by_id(user_id))
+    assert by_email["_id"] == by_id["_id"] == user_id
+    assert by_email["full_name"] == "Test Patient"
+    assert by_email["is_active"] is True
+    assert by_email.get("test_history", []) == []
+
+def test_create_user_rejects_history(repo):
+    doc = user_doc()
+    doc["test_history"] = [report()]
+    with pytest.raises(ValueError):
+        run(repo.create_user(doc))
+    assert run(repo.find_by_email("patient@example.com")) is None
+
+def test_find_unknown_user(repo):
+    assert run(repo.find_by_email("nobody@example.com")) is None
+    assert run(repo.find_by_id(ObjectId())) is None
+
+def test_update_calibration(repo):
+    create(repo)
+    updated_at = datetime.utcnow().replace(microsecond=0)
+    user = run(repo.update_calibration("patient@example.com", {
+        "focal_length": 612.5, "pixels_per_mm": 3.8, "updated_at": updated_at
+    }))
+    assert user["focal_length"] == 612.5
+    assert user["pixels_per_mm"] == 3.8
+    assert user["updated_at"] == updated_at
+    assert run(repo.find_by_email("patient@example.com"))["focal_length"] == 612.5
+
+def test_append_report(repo):
+    user_id = create(repo)
+    user = run(repo.append_report(user_id, report()))
+    assert [r["final_acuity"] for r in user["test_history"]] == ["6/6"]
+    assert user["test_history"][0]["timestamp"] == DAY
+
+def test_append_report_unknown_user(repo):
+    assert run(repo.append_report(ObjectId(), report())) is None
+    assert run(repo.get_rollups(SCOPE_DAILY)) == []
+
+def test_get_history_newest_first_with_limit(repo):
+    user_id = create(repo)
+    for minutes, acuity in enumerate(["6/12", "6/9", "6/6"]):
+        run(repo.append_report(user_id, report(final_acuity=acuity, timestamp=DAY + timedelta(minutes=minutes))))
+
+    history = run(repo.get_history(user_id))
+    assert [r["final_acuity"] for r in history] == ["6/6", "6/9", "6/12"]
+    assert [r["final_acuity"] for r in run(repo.get_history(user_id, limit=2))] == ["6/6", "6/9"]
+    assert run(repo.get_history(ObjectId())) == []
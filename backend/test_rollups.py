@@ -0,0 +1,86 @@
+"""Acuity rollups maintained by append_report and rebuild_rollups, on both backends."""
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from conftest import DAY, create, report, run
+from rollups import SCOPE_DAILY, SCOPE_USER_DAILY, RollupDeltas, summarize
+
+def test_deltas_merge_per_key_and_summarize():
+    deltas = RollupDeltas()
+    deltas.add("u1", report(1.0, "6/6"))
+    deltas.add("u2", report(0.5, "6/12"))
+    assert len(deltas) == 2
+    # One clinic-wide key plus one per user
+    assert len(deltas.deltas) == 3
+
+    daily = deltas.deltas[(SCOPE_DAILY, "2024-03-01", "LandoltC", "")]
+    summary = summarize(SCOPE_DAILY, "2024-03-01", "LandoltC", None, daily)
+    assert summary["count"] == 2
+    assert summary["mean_decimal_acuity"] == pytest.approx(0.75)
+    assert summary["variance_decimal_acuity"] == pytest.approx(0.0625)
+    assert "user_id" not in summary
+
+def test_rollups(repo):
+    first = create(repo, "first@example.com")
+    second = create(repo, "second@example.com")
+    run(repo.append_report(first, report(1.0, "6/6")))
+    run(repo.append_report(first, report(0.5, "6/12", timestamp=DAY + timedelta(days=1))))
+    run(repo.append_report(second, report(0.5, "6/12")))
+    run(repo.append_report(second, report(0.8, "6/7.5", test_type="Snellen")))
+
+    daily = run(repo.get_rollups(SCOPE_DAILY))
+    assert [(r["day"], r["test_type"], r["count"]) for r in daily] == [
+        ("2024-03-01", "LandoltC", 2), ("2024-03-01", "Snellen", 1), ("2024-03-02", "LandoltC", 1)
+    ]
+    landolt = daily[0]
+    assert landolt["mean_decimal_acuity"] == pytest.approx(0.75)
+    assert landolt["min_decimal_acuity"] == 0.5 and landolt["max_decimal_acuity"] == 1.0
+    assert landolt["final_acuity_histogram"] == {"6/6": 1, "6/12": 1}
+
+    per_user = run(repo.get_rollups(SCOPE_USER_DAILY, user_id=str(first)))
+    assert [(r["day"], r["count"]) for r in per_user] == [("2024-03-01", 1), ("2024-03-02", 1)]
+    assert run(repo.get_rollups(SCOPE_DAILY, test_type="Snellen"))[0]["final_acuity_histogram"] == {"6/7.5": 1}
+    assert [r["day"] for r in run(repo.get_rollups(SCOPE_DAILY, start="2024-03-02"))] == ["2024-03-02"]
+
+def test_histogram_labels_round_trip(repo):
+    user_id = create(repo)
+    labels = ["6/7.5", "$6/6", "20%", "6/7_5", ""]
+    for label in labels:
+        run(repo.append_report(user_id, report(final_acuity=label)))
+    histogram = run(repo.get_rollups(SCOPE_DAILY))[0]["final_acuity_histogram"]
+    assert histogram == {label: 1 for label in labels}
+
+def test_rebuild_rollups_matches_live(repo):
+    user_id = create(repo)
+    for day in range(3):
+        run(repo.append_report(user_id, report(0.5 + day / 10, timestamp=DAY + timedelta(days=day))))
+
+    live = run(repo.get_rollups(SCOPE_DAILY)), run(repo.get_rollups(SCOPE_USER_DAILY))
+    assert run(repo.rebuild_rollups(batch_size=2)) == 3
+    assert (run(repo.get_rollups(SCOPE_DAILY)), run(repo.get_rollups(SCOPE_USER_DAILY))) == live
+
+def test_rebuild_rollups_keeps_serving_reads(repo):
+    user_id = create(repo)
+    for day in range(5):
+        run(repo.append_report(user_id, report(timestamp=DAY + timedelta(days=day))))
+
+    async def rebuild_while_reading_and_writing():
+        rebuild = asyncio.create_task(repo.rebuild_rollups(batch_size=1))
+        seen, appended = [], False
+        while not rebuild.done():
+            seen.append(sum(r["count"] for r in await repo.get_rollups(SCOPE_DAILY)))
+            if not appended:
+                await repo.append_report(user_id, report(timestamp=DAY))
+                appended = True
+            await asyncio.sleep(0)
+        await rebuild
+        if not appended:
+            await repo.append_report(user_id, report(timestamp=DAY))
+        return seen
+
+    seen = run(rebuild_while_reading_and_writing())
+    # Never empty or partial, and the report saved mid-rebuild counted once
+    assert all(count >= 5 for count in seen)
+    assert sum(r["count"] for r in run(repo.get_rollups(SCOPE_DAILY))) == 6
@@ -6,6 +6,7 @@ import ProtectedRoute from './components/ProtectedRoute';
 import Login from './components/Login';
 import SignupWithCalibration from './components/SignupWithCalibration';
 import RecalibrationModal from './components/RecalibrationModal';
+import { SessionChannel } from './sessionSocket';
 
 // --- 1. NEW COMPONENT: HistoryView ---
 const HistoryView = ({ history, onBack }) => {
@@ -96,6 +97,23 @@ function FaceDetectionApp() {
     const consecutiveTargetFrames = useRef(0);
     const framesSinceLastFace = useRef(0);
     const countdownTimerRef = useRef(null);
+    // Read by the long-lived channel handlers, which must not be recreated on every state change
+    const isMeasuringRef = useRef(false);
+    const isDistanceReachedRef = useRef(false);
+    const logoutRef = useRef(logout);
+
+    useEffect(() => { isMeasuringRef.current = isMeasuring; }, [isMeasuring]);
+    useEffect(() => { isDistanceReachedRef.current = isDistanceReached; }, [isDistanceReached]);
+    useEffect(() => { logoutRef.current = logout; }, [logout]);
+
+    const sendStartDistance = () => {
+        ws.current.send(JSON.stringify({ 
+            command: "start_distance",
+            focal_length: window.userCalibration.focal_length,
+            pixels_per_mm: window.userCalibration.pixels_per_mm,
+            screen_ppi: window.userCalibration.screen_ppi
+        }));
+    };
 
     // Load user calibration data when user logs in
     useEffect(() => {
@@ -152,17 +170,18 @@ function FaceDetectionApp() {
         }
     }, [isDistanceReached, lastFaceDetected]);
 
-    // WebSocket connection
+    // WebSocket connection (frames channel of the shared /ws_session connection).
+    // One channel per login: closing it would end the server session and its measurement state.
     useEffect(() => {
         if (!token || !user) return;
         const storedToken = localStorage.getItem('authToken');
         
-        ws.current = new WebSocket(`ws://${window.location.host}/ws`);
+        ws.current = new SessionChannel('frames', storedToken || token);
 
         ws.current.onopen = () => {
             setConnectionStatus('connected');
-            const tokenToSend = storedToken || token;
-            ws.current.send(JSON.stringify({ token: tokenToSend }));
+            // A new connection starts a new server session with measurement off
+            if (isMeasuringRef.current && window.userCalibration?.focal_length) sendStartDistance();
         };
 
         ws.current.onclose = () => setConnectionStatus('disconnected');
@@ -171,7 +190,7 @@ function FaceDetectionApp() {
             const data = JSON.parse(event.data);
             if (data.error) {
                 setStatusMessage(`Error: ${data.error}`);
-                if (data.error.includes('Authentication')) logout();
+                if (data.error.includes('Authentication')) logoutRef.current();
                 return;
             }
 
@@ -183,7 +202,7 @@ function FaceDetectionApp() {
                     framesSinceLastFace.current = 0;
                 }
 
-                if (data.faces && data.faces.length > 0 && isMeasuring) {
+                if (data.faces && data.faces.length > 0 && isMeasuringRef.current) {
                     const distance = data.faces[0].distance;
                     setCurrentDistance(distance > 0 ? `${distance}m` : 'Calculating...');
                     
@@ -191,7 +210,8 @@ function FaceDetectionApp() {
                         setAtTargetDistance(true);
                         consecutiveTargetFrames.current++;
                         
-                        if (consecutiveTargetFrames.current >= 15 && !isDistanceReached) {
+                        if (consecutiveTargetFrames.current >= 15 && !isDistanceReachedRef.current) {
+                            isDistanceReachedRef.current = true;
                             setIsDistanceReached(true);
                             setStatusMessage(" Perfect! 4m reached! Starting vision test...");
                             startCountdown();
@@ -221,7 +241,7 @@ function FaceDetectionApp() {
         };
         
         return () => { if (ws.current) ws.current.close(); };
-    }, [isMeasuring, isDistanceReached, token, user, logout]);
+    }, [token, user]);
 
     const startMeasuringDistance = async () => {
         if (!user) return;
@@ -236,18 +256,15 @@ function FaceDetectionApp() {
 
         if (ws.current && ws.current.readyState === WebSocket.OPEN) {
             setShowCamera(true);
+            isMeasuringRef.current = true;
+            isDistanceReachedRef.current = false;
             setIsMeasuring(true);
             setIsDistanceReached(false);
             setAtTargetDistance(false);
             consecutiveTargetFrames.current = 0;
             framesSinceLastFace.current = 0;
             
-            ws.current.send(JSON.stringify({ 
-                command: "start_distance",
-                focal_length: window.userCalibration.focal_length,
-                pixels_per_mm: window.userCalibration.pixels_per_mm,
-                screen_ppi: window.userCalibration.screen_ppi
-            }));
+            sendStartDistance();
             
             setStatusMessage(`🎯 Move to 4m (FL: ${window.userCalibration.focal_length?.toFixed(2)})`);
             detectionInterval.current = setInterval(sendFrame, 100);
@@ -257,6 +274,7 @@ function FaceDetectionApp() {
     };
 
     const stopMeasuringDistance = () => {
+        isMeasuringRef.current = false;
         setIsMeasuring(false);
         setShowCamera(false);
         setAtTargetDistance(false);
@@ -1,4 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
+import { SessionChannel } from '../sessionSocket';
 
 // --- Report Component ---
 const IconRefresh = ({ className }) => (
@@ -144,6 +145,7 @@ const LandoltC = ({ onClose, onHome, onUserUpdate }) => {
   const canvasRef = useRef(null);
   const componentRef = useRef(null); 
   const [pixelsPerMm, setPixelsPerMm] = useState(null);
+  const [ladderSizes, setLadderSizes] = useState(null); // acuity -> Landolt C size in px
   const [viewingDistance, setViewingDistance] = useState(400); // 400cm = 4m
   
   const ACUITY_LEVELS = [
@@ -248,13 +250,13 @@ const LandoltC = ({ onClose, onHome, onUserUpdate }) => {
     };
   }, []);
 
-  // 1. Fetch Screen PPI
+  // 1. Fetch Optotype Size Ladder (server computes it once per calibration, revalidated via ETag)
   useEffect(() => {
-    const fetchScreenPPI = async () => {
+    const fetchOptotypeLadder = async () => {
       try {
         setVoiceStatus('Loading screen configuration...');
         const token = localStorage.getItem('authToken');
-        const apiUrl = `${window.location.protocol}//${window.location.host}/api/get-screen-ppi`;
+        const apiUrl = `${window.location.protocol}//${window.location.host}/api/optotype-ladder`;
         
         const response = await fetch(apiUrl, {
           method: 'GET',
@@ -263,22 +265,22 @@ const LandoltC = ({ onClose, onHome, onUserUpdate }) => {
         
         if (response.ok) {
           const data = await response.json();
-          const ppi = data.screen_ppi;
-          if (!ppi || ppi <= 0) throw new Error('Invalid PPI received');
-          setPixelsPerMm(ppi / 25.4);
+          if (!data.pixels_per_mm || data.pixels_per_mm <= 0) throw new Error('Invalid ladder received');
+          setLadderSizes(Object.fromEntries(data.levels.map((level) => [level.acuity, level.size_px])));
+          setPixelsPerMm(data.pixels_per_mm);
           setVoiceStatus('Screen configured. Connecting...');
           setTestStarted(true);
         } else {
-          throw new Error(`Failed to fetch PPI: ${response.statusText}`);
+          throw new Error(`Failed to fetch ladder: ${response.statusText}`);
         }
       } catch (error) {
-        console.error("[PPI Error]:", error);
+        console.error("[Ladder Error]:", error);
         setPixelsPerMm(96 / 25.4); // Fallback PPI
         setVoiceStatus('Using default config. Connecting...');
         setTestStarted(true);
       }
     };
-    fetchScreenPPI();
+    fetchOptotypeLadder();
     return () => cleanup();
   }, []);
 
@@ -304,15 +306,17 @@ const LandoltC = ({ onClose, onHome, onUserUpdate }) => {
       return;
     }
     
-    const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${wsProtocol}//${window.location.host}/ws_voice?token=${encodeURIComponent(token)}`;
-    
-    const ws = new WebSocket(wsUrl);
+    // Voice channel of the shared /ws_session connection; it opens once the
+    // connection is authenticated
+    const ws = new SessionChannel('voice', token);
     let reconnectAttempts = 0;
 
     ws.onopen = () => {
-      setVoiceStatus('Connected. Waiting for auth...');
       reconnectAttempts = 0;
+      setVoiceStatus(`Authenticated.`);
+      setVoiceSocket(ws);
+      voiceSocketRef.current = ws;
+      ws.send(JSON.stringify({ command: 'prepare_voice_model' }));
     };
     
     ws.onmessage = (event) => {
@@ -324,12 +328,6 @@ const LandoltC = ({ onClose, onHome, onUserUpdate }) => {
         }
 
         switch (data.status) {
-          case 'authenticated':
-            setVoiceStatus(`Authenticated.`);
-            setVoiceSocket(ws);
-            voiceSocketRef.current = ws;
-            ws.send(JSON.stringify({ command: 'prepare_voice_model' }));
-            break;
           case 'ready_for_test':
             setVoiceStatus("Ready! Say 'Start' or wait.");
             setMicrophoneActive(true);
@@ -924,6 +922,7 @@ const LandoltC = ({ onClose, onHome, onUserUpdate }) => {
   const getLandoltCSize = (acuityStr = null) => {
     if (!pixelsPerMm) return 60;
     const currentAcuity = acuityStr || ACUITY_LEVELS[currentAcuityIndex];
+    if (ladderSizes && ladderSizes[currentAcuity]) return ladderSizes[currentAcuity];
     const sizeInMm = getAcuitySizeInMm(currentAcuity);
     return sizeInMm * pixelsPerMm;
   };
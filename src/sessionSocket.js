@@ -0,0 +1,93 @@
+// One authenticated /ws_session connection shared by every component.
+// Components talk to it through a SessionChannel, which behaves like a
+// WebSocket (onopen/onmessage/onclose, send, close, readyState) but only
+// sees messages of its own channel plus the shared "control" channel.
+
+let socket = null;
+let authenticated = false;
+const channels = new Set();
+
+const connect = (token) => {
+  if (socket && (socket.readyState === WebSocket.CONNECTING || socket.readyState === WebSocket.OPEN)) {
+    return;
+  }
+  const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+  const ws = new WebSocket(`${wsProtocol}//${window.location.host}/ws_session?token=${encodeURIComponent(token)}`);
+  socket = ws;
+  authenticated = false;
+
+  ws.onmessage = (event) => {
+    if (ws !== socket) return;
+    const data = JSON.parse(event.data);
+    if (data.channel === 'control' && data.status === 'authenticated') {
+      authenticated = true;
+      channels.forEach((channel) => channel._open());
+      return;
+    }
+    channels.forEach((channel) => channel._deliver(data, event));
+  };
+
+  ws.onerror = (error) => {
+    if (ws !== socket) return;
+    channels.forEach((channel) => channel.onerror && channel.onerror(error));
+  };
+
+  ws.onclose = (event) => {
+    // A newer connection may already have replaced this one
+    if (ws !== socket) return;
+    socket = null;
+    authenticated = false;
+    const closed = [...channels];
+    channels.clear();
+    closed.forEach((channel) => channel.onclose && channel.onclose(event));
+  };
+};
+
+export class SessionChannel {
+  constructor(name, token) {
+    this.name = name;
+    this.onopen = null;
+    this.onmessage = null;
+    this.onclose = null;
+    this.onerror = null;
+    this._opened = false;
+    channels.add(this);
+    connect(token);
+    // Joining a connection that is already authenticated
+    if (authenticated) setTimeout(() => this._open(), 0);
+  }
+
+  get readyState() {
+    if (!channels.has(this)) return WebSocket.CLOSED;
+    return this._opened ? WebSocket.OPEN : WebSocket.CONNECTING;
+  }
+
+  send(message) {
+    if (!socket || socket.readyState !== WebSocket.OPEN || !channels.has(this)) return;
+    const payload = typeof message === 'string' ? JSON.parse(message) : message;
+    socket.send(JSON.stringify({ ...payload, channel: this.name }));
+  }
+
+  close(code = 1000, reason = '') {
+    if (!channels.delete(this)) return;
+    // The connection closes once its last channel is gone
+    if (channels.size === 0 && socket) {
+      socket.close(1000, reason);
+      socket = null;
+      authenticated = false;
+    }
+    if (this.onclose) this.onclose({ code, reason });
+  }
+
+  _open() {
+    if (this._opened || !channels.has(this)) return;
+    this._opened = true;
+    if (this.onopen) this.onopen();
+  }
+
+  _deliver(data, event) {
+    if ((data.channel === this.name || data.channel === 'control') && this.onmessage) {
+      this.onmessage(event);
+    }
+  }
+}